@@ -8,16 +8,66 @@ Author: C. Daniel Greenidge <dev@danielgreenidge.com>
 Date: 2019-06-17
 
 """
+import atexit
+import functools
 import heapq
 import math
+import operator
 import typing
-from typing import Any, Callable, Sequence, Tuple, TypeVar, Optional
-
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Sequence,
+    Set,
+    Tuple,
+    TypeVar,
+    Optional,
+    Union,
+)
+
+import dask.base
 import dask.distributed
+import dask.utils
+import numpy as np
 
 Config = TypeVar("Config")
 """A generic type variable representing a hyperparameter configuration."""
 
+_DEFAULT_CLIENT: Optional[dask.distributed.Client] = None
+"""The client shared by every `Hyperband` instance that wasn't given one."""
+
+
+def _default_client() -> dask.distributed.Client:
+    """Return a client of a local cluster, starting it on first use."""
+    global _DEFAULT_CLIENT
+    if _DEFAULT_CLIENT is None or _DEFAULT_CLIENT.status != "running":
+        # Closing the shared client leaves its cluster running, so shut that down
+        # rather than orphan it
+        _close_default_client()
+        # Evaluations share this process, so run one at a time and leave the cores to
+        # the BLAS or OpenMP threads of a NumPy or PyTorch loss rather than
+        # oversubscribing them
+        cluster = dask.distributed.LocalCluster(
+            processes=False, n_workers=1, threads_per_worker=1, dashboard_address=None
+        )
+        _DEFAULT_CLIENT = dask.distributed.Client(cluster)
+    return _DEFAULT_CLIENT
+
+
+def _close_default_client() -> None:
+    """Shut down the default client and its cluster, if they are still running."""
+    if _DEFAULT_CLIENT is None:
+        return
+    cluster = _DEFAULT_CLIENT.cluster
+    if _DEFAULT_CLIENT.status == "running":
+        _DEFAULT_CLIENT.close()
+    cluster.close()
+
+
+atexit.register(_close_default_client)
+
 
 class ConfigEvaluation(typing.NamedTuple):
     """Contains the results of evaluating a hyperparameter configuration."""
@@ -31,54 +81,547 @@ class ConfigEvaluation(typing.NamedTuple):
         )
 
 
-def _top_k(
-    configs: Sequence[Config], losses: Sequence[float], k: int
-) -> Tuple[Tuple[Config, ...], Tuple[float, ...]]:
-    """Return the k configs with the best (lowest) losses."""
-    assert k >= 1
-    losses, configs = zip(*heapq.nsmallest(k, zip(losses, configs)))
-    return configs, losses
+class BracketPlan(typing.NamedTuple):
+    """The schedule of a single bracket of SuccessiveHalving.
+
+    Attributes:
+        n: The initial number of configurations to sample.
+        r: The minimum resource to allocate to each configuration.
+        n_is: The number of configurations evaluated in each round.
+        r_is: The resources allocated to each configuration in each round.
+        k_is: The number of configurations kept after each round.
+
+    """
+
+    n: int
+    r: float
+    n_is: Tuple[int, ...]
+    r_is: Tuple[float, ...]
+    k_is: Tuple[int, ...]
+
+
+@functools.lru_cache(maxsize=None)
+def _bracket_schedule(R: float, eta: float, s_max: int) -> Tuple[BracketPlan, ...]:
+    """Return the plans of the brackets s = s_max, ..., 0 of a Hyperband run.
+
+    The schedule only depends on its arguments, so it is computed once per process for
+    each distinct `(R, eta)` and shared between `Hyperband` instances.
+
+    """
+    # Every power of eta the schedule needs, indexed by exponent, so each is only
+    # computed once
+    eta_pow = [eta ** i for i in range(s_max + 1)]
+
+    schedule = []
+    for s in range(s_max, -1, -1):
+        # B / R is exactly s_max + 1, and dividing by eta ** i rather than multiplying
+        # by eta ** -i keeps exact quotients exact, so floor() doesn't round them down
+        n = math.ceil((s_max + 1) * eta_pow[s] / (s + 1))
+        r = R / eta_pow[s]
+        n_is = tuple(math.floor(n / eta_pow[i]) for i in range(s + 1))
+        schedule.append(
+            BracketPlan(
+                n=n,
+                r=r,
+                n_is=n_is,
+                r_is=tuple(r * eta_pow[i] for i in range(s + 1)),
+                k_is=tuple(max(1, math.floor(n_i / eta)) for n_i in n_is),
+            )
+        )
+    return tuple(schedule)
+
+
+class _Rung(typing.NamedTuple):
+    """The configurations in a round of SuccessiveHalving, stored column-wise."""
+
+    configs: np.ndarray
+    handles: np.ndarray
+    losses: np.ndarray
+    states: np.ndarray
+
+
+def _object_array(values: Sequence[Any]) -> np.ndarray:
+    """Return a 1-d object array of values, without unpacking tuple-like values."""
+    return np.fromiter(values, dtype=object, count=len(values))
+
+
+def _evaluation_keys(
+    func: Callable[..., Any],
+    handles: Sequence[dask.distributed.Future],
+    *resources: float,
+) -> List[str]:
+    """Return Dask task keys identifying the evaluation of each config on resources."""
+    prefix = dask.utils.funcname(func)
+    return [
+        "{0}-{1}".format(prefix, dask.base.tokenize(func, handle.key, *resources))
+        for handle in handles
+    ]
+
+
+def _submit_evaluations(
+    client: dask.distributed.Client,
+    run_then_return_val_loss: Callable[..., Any],
+    incremental: bool,
+    handles: Sequence[dask.distributed.Future],
+    states: Sequence[Any],
+    r_is: Sequence[float],
+    priority: int,
+) -> Tuple[List[dask.distributed.Future], List[Any]]:
+    """Submit the evaluation of scattered configs on the last of the resources r_is.
+
+    Returns:
+        The futures of the losses, and the training states to resume from next time.
+
+    """
+    # Map the loss function itself rather than a per-rung closure, so it is shipped to
+    # the workers once instead of being re-pickled for every rung
+    run = run_then_return_val_loss
+    if not incremental:
+        losses = client.map(
+            run,
+            handles,
+            [r_is[-1]] * len(handles),
+            key=_evaluation_keys(run, handles, r_is[-1]),
+            priority=priority,
+        )
+        return losses, list(states)
+
+    # A state depends on every round it was trained in, not just the last one. States
+    # stay on the workers as futures and are handed straight to the next round, only
+    # the losses come back to the client.
+    r_prev = r_is[-2] if len(r_is) > 1 else 0.0
+    keys = _evaluation_keys(run, handles, *r_is)
+    results = client.map(
+        run,
+        handles,
+        [r_prev] * len(handles),
+        [r_is[-1]] * len(handles),
+        states,
+        key=keys,
+        priority=priority,
+    )
+    losses = client.map(
+        operator.itemgetter(0),
+        results,
+        key=["loss-" + key for key in keys],
+        priority=priority,
+    )
+    states = client.map(
+        operator.itemgetter(1),
+        results,
+        key=["state-" + key for key in keys],
+        priority=priority,
+    )
+    return losses, states
+
+
+# Up to this many survivors, a heap over a round's losses is faster than copying them
+# into arrays for `_smallest`
+_HEAP_MAX_K = 8
+
+
+def _smallest(losses: np.ndarray, k: int) -> np.ndarray:
+    """Return the indices of the k smallest losses, in increasing order of loss."""
+    assert 1 <= k <= len(losses)
+    if k == 1:
+        # The last round of every bracket keeps a single config, and a single argmin
+        # pass is cheaper than a partition and a sort. argmin picks NaN losses first,
+        # though, while the partition sorts them last, so fall through for those
+        best = np.argmin(losses)
+        if not np.isnan(losses[best]):
+            return np.array([best])
+    best = np.argpartition(losses, k - 1)[:k]
+    return best[np.argsort(losses[best])]
+
+
+def _top_k(rung: _Rung, k: int) -> _Rung:
+    """Return the k configs with the best (lowest) losses, along with their states."""
+    best = _smallest(rung.losses, k)
+    return _Rung(
+        rung.configs[best], rung.handles[best], rung.losses[best], rung.states[best]
+    )
+
+
+def _collect(*losses: float) -> List[float]:
+    """Return the losses of a round of successive halving as a list."""
+    return list(losses)
+
+
+class _Bracket:
+    """A bracket of successive halving, advanced one round at a time.
+
+    See `successive_halving` for a description of the arguments.
+
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        plan: BracketPlan,
+        configs: Sequence[Config],
+        handles: Sequence[dask.distributed.Future],
+        run_then_return_val_loss: Callable[..., Any],
+        incremental: bool,
+    ) -> None:
+        self.plan = plan
+        self.run_then_return_val_loss = run_then_return_val_loss
+        self.incremental = incremental
+        self.i = 0
+        self.rung = _Rung(
+            configs=_object_array(configs),
+            handles=_object_array(handles),
+            losses=np.full(len(configs), np.inf),
+            states=np.full(len(configs), None, dtype=object),
+        )
+
+        # Evaluations are keyed on (config, resources), so Dask computes each distinct
+        # pair only once while its future is alive. Hold on to every round's futures
+        # until the search finishes so repeated pairs reuse the stored loss.
+        self.evaluated: List[dask.distributed.Future] = []
+
+        # Added to the priority of every round, to rank this bracket against others
+        self.precedence = 0
+
+    @property
+    def done(self) -> bool:
+        """Whether every round of the bracket has been run."""
+        return self.i == len(self.plan.r_is)
+
+    def start(self, client: dask.distributed.Client) -> List[dask.distributed.Future]:
+        """Submit the first round, and return the futures to wait on."""
+        return self._submit_round(client)
+
+    def update(
+        self, client: dask.distributed.Client, future: dask.distributed.Future
+    ) -> List[dask.distributed.Future]:
+        """Move on from a finished round, and return the futures to wait on next."""
+        rung = self.rung._replace(losses=np.asarray(future.result(), dtype=float))
+        self.rung = _top_k(rung, min(self.plan.k_is[self.i], len(rung.losses)))
+        self.i += 1
+        return [] if self.done else self._submit_round(client)
+
+    def result(self) -> ConfigEvaluation:
+        """Return the best configuration of a finished bracket."""
+        assert self.done
+        return ConfigEvaluation(self.rung.configs[0], float(self.rung.losses[0]))
+
+    def _submit_round(
+        self, client: dask.distributed.Client
+    ) -> List[dask.distributed.Future]:
+        """Submit the current round, joined by a single future of all its losses."""
+        # Brackets run concurrently, so favour the rounds with the most rounds still
+        # to come after them: they sit on the longest remaining path through the search
+        priority = self.precedence + len(self.plan.r_is) - 1 - self.i
+
+        run_batch = getattr(self.run_then_return_val_loss, "run_batch", None)
+        if run_batch is not None and not self.incremental:
+            # Evaluate the whole round in a single task, which is far cheaper than a
+            # task per configuration when the loss is cheap and vectorized. The task
+            # is keyed on the whole round, so only an identical round is reused.
+            handles = list(self.rung.handles)
+            r_i = self.plan.r_is[self.i]
+            key = "{0}-{1}".format(
+                dask.utils.funcname(run_batch),
+                dask.base.tokenize(run_batch, [handle.key for handle in handles], r_i),
+            )
+            batch = client.submit(run_batch, handles, r_i, key=key, priority=priority)
+            self.evaluated.append(batch)
+            return [batch]
+
+        losses, states = _submit_evaluations(
+            client,
+            self.run_then_return_val_loss,
+            self.incremental,
+            self.rung.handles,
+            self.rung.states,
+            self.plan.r_is[: self.i + 1],
+            priority,
+        )
+        self.evaluated.extend(losses)
+        self.rung = self.rung._replace(states=_object_array(states))
+        return [client.submit(_collect, *losses, pure=False, priority=priority)]
+
+
+class _AsynchronousBracket:
+    """A bracket of asynchronous successive halving (ASHA).
+
+    Rather than waiting for a whole round to finish, a configuration is promoted to the
+    next round as soon as it ranks in the top 1 / eta of the results of its round so
+    far. A round never promotes more configurations than synchronous successive halving
+    would, and once it has finished, it has promoted exactly as many. See
+    `successive_halving` for a description of the arguments.
+
+    """
+
+    def __init__(  # noqa: D107
+        self,
+        plan: BracketPlan,
+        configs: Sequence[Config],
+        handles: Sequence[dask.distributed.Future],
+        run_then_return_val_loss: Callable[..., Any],
+        incremental: bool,
+        eta: float,
+    ) -> None:
+        self.plan = plan
+        self.run_then_return_val_loss = run_then_return_val_loss
+        self.incremental = incremental
+        self.eta = eta
+        self.configs = _object_array(configs)
+        self.handles = _object_array(handles)
+        self.states = np.full(len(configs), None, dtype=object)
+
+        # For each round, the number of configurations it receives in all, as in
+        # `_Bracket`, the losses of those that have finished by config index, and the
+        # indices promoted from it
+        n_rounds = len(plan.r_is)
+        self.sizes = [len(configs)]
+        for k_i in plan.k_is[:-1]:
+            self.sizes.append(min(k_i, self.sizes[-1]))
+        self.losses: List[Dict[int, float]] = [{} for _ in range(n_rounds)]
+        self.promoted: List[Set[int]] = [set() for _ in range(n_rounds)]
+
+        # The rounds with a NaN loss, which a heap cannot order
+        self.nan_rounds: Set[int] = set()
+
+        # The (config index, round) pairs waiting on each key, and, as in `_Bracket`,
+        # every evaluation submitted so far and the bracket's precedence
+        self.waiting: Dict[str, List[Tuple[int, int]]] = {}
+        self.evaluated: List[dask.distributed.Future] = []
+        self.precedence = 0
+
+    @property
+    def done(self) -> bool:
+        """Whether every submitted evaluation has finished."""
+        return not self.waiting
+
+    def start(self, client: dask.distributed.Client) -> List[dask.distributed.Future]:
+        """Submit every configuration to the first round, and return the futures."""
+        return self._submit(client, list(range(len(self.configs))), 0)
+
+    def update(
+        self, client: dask.distributed.Client, future: dask.distributed.Future
+    ) -> List[dask.distributed.Future]:
+        """Record a finished evaluation, and return the futures of any promotions."""
+        futures = []
+        for j, i in self.waiting.pop(future.key):
+            loss = self.losses[i][j] = future.result()
+            if math.isnan(loss):
+                self.nan_rounds.add(i)
+            if i + 1 < len(self.plan.r_is):
+                futures.extend(self._submit(client, self._promotable(i), i + 1))
+        return futures
+
+    def result(self) -> ConfigEvaluation:
+        """Return the best configuration of the highest round reached."""
+        assert self.done
+        losses = next(losses for losses in reversed(self.losses) if losses)
+        j = min(losses, key=losses.__getitem__)
+        return ConfigEvaluation(self.configs[j], losses[j])
+
+    def _promotable(self, i: int) -> List[int]:
+        """Return the configurations of round i that have earned a promotion."""
+        losses = self.losses[i]
+        quota = self.sizes[i + 1]
+        if len(losses) == self.sizes[i]:
+            k = quota
+        else:
+            k = min(quota, math.floor(len(losses) / self.eta))
+
+        # A config promoted early keeps its place even if it later drops out of the top
+        # k, so stop promoting once the next round is full
+        slots = quota - len(self.promoted[i])
+        if k < 1 or slots < 1:
+            return []
+        if k <= _HEAP_MAX_K and i not in self.nan_rounds:
+            # Rank the losses in place, since few configurations are promoted
+            best = heapq.nsmallest(k, losses, key=losses.__getitem__)
+        else:
+            indices = np.fromiter(losses.keys(), dtype=int, count=len(losses))
+            values = np.fromiter(losses.values(), dtype=float, count=len(losses))
+            best = list(indices[_smallest(values, k)])
+        return [j for j in best if j not in self.promoted[i]][:slots]
+
+    def _submit(
+        self, client: dask.distributed.Client, indices: List[int], i: int
+    ) -> List[dask.distributed.Future]:
+        """Submit the configurations at the given indices to round i."""
+        if not indices:
+            return []
+        if i > 0:
+            self.promoted[i - 1].update(indices)
+
+        losses, states = _submit_evaluations(
+            client,
+            self.run_then_return_val_loss,
+            self.incremental,
+            self.handles[indices],
+            self.states[indices],
+            self.plan.r_is[: i + 1],
+            self.precedence + len(self.plan.r_is) - 1 - i,
+        )
+        self.states[indices] = _object_array(states)
+        self.evaluated.extend(losses)
+        for j, future in zip(indices, losses):
+            self.waiting.setdefault(future.key, []).append((j, i))
+        return losses
+
+
+def _run_brackets(
+    client: dask.distributed.Client,
+    plans: Sequence[BracketPlan],
+    samples: Sequence[Sequence[Config]],
+    run_then_return_val_loss: Callable[..., Any],
+    eta: float,
+    incremental: bool,
+    asynchronous: bool,
+    patience: Optional[int] = None,
+) -> List[ConfigEvaluation]:
+    """Run brackets of successive halving concurrently and return their results.
+
+    If `patience` is given, stop once that many brackets in a row, taken in the order of
+    `plans`, have not improved on the best loss so far, and return the results up to
+    there.
+
+    """
+    # Deduplicate the configs sampled by each bracket: a config sampled twice would
+    # be trained twice and could take up two of the survivors' places
+    distinct = [
+        dict(zip((dask.base.tokenize(config) for config in configs), configs))
+        for configs in samples
+    ]
+
+    # Scatter every bracket's configs in a single call, and have every round submit
+    # the survivors' handles rather than the configs themselves, so a configuration is
+    # only ever serialized once. A config sampled by several brackets shares one
+    # handle, so its evaluations share their keys too. The handles' keys are fresh for
+    # every search, so they never collide with data a previous search is releasing.
+    unique = {}
+    for configs in distinct:
+        unique.update(configs)
+    scattered = dict(zip(unique, client.scatter(list(unique.values()), hash=False)))
+
+    brackets: List[Union[_Bracket, _AsynchronousBracket]] = []
+    for plan, configs in zip(plans, distinct):
+        args = (
+            plan,
+            list(configs.values()),
+            [scattered[token] for token in configs],
+            run_then_return_val_loss,
+        )
+        if asynchronous:
+            brackets.append(_AsynchronousBracket(*args, incremental, eta))
+        else:
+            brackets.append(_Bracket(*args, incremental))
+
+    if patience is not None:
+        # Patience counts finished brackets in order, so run them in that order too.
+        # Later brackets then only take up the workers earlier ones leave idle, and
+        # have the least work to cancel if the search stops before reaching them.
+        n_rounds = max(len(plan.r_is) for plan in plans)
+        for b, bracket in enumerate(brackets):
+            bracket.precedence = (len(brackets) - b) * n_rounds
+
+    # The brackets are driven from here rather than from tasks on the workers, so no
+    # worker is tied up waiting on a round, and whichever bracket has work ready gets
+    # it submitted first. Several brackets may be waiting on the same key.
+    watchers: Dict[str, List[Union[_Bracket, _AsynchronousBracket]]] = {}
+    pending = dask.distributed.as_completed()
+
+    def watch(
+        bracket: Union[_Bracket, _AsynchronousBracket],
+        futures: List[dask.distributed.Future],
+    ) -> None:
+        for future in futures:
+            if future.key not in watchers:
+                watchers[future.key] = []
+                pending.add(future)
+            if bracket not in watchers[future.key]:
+                watchers[future.key].append(bracket)
+
+    for bracket in brackets:
+        watch(bracket, bracket.start(client))
+
+    # Finished brackets are only counted in order, so stopping early gives the same
+    # results as running the brackets one after the other and stopping there
+    results: List[ConfigEvaluation] = []
+    best = math.inf
+    stale = 0
+    for future in pending:
+        for bracket in watchers.pop(future.key):
+            watch(bracket, bracket.update(client, future))
+        while len(results) < len(brackets) and brackets[len(results)].done:
+            result = brackets[len(results)].result()
+            results.append(result)
+            if result.loss < best:
+                best, stale = result.loss, 0
+            else:
+                stale += 1
+            if patience is not None and stale >= patience:
+                # Cancel the unfinished brackets' evaluations along with the rounds
+                # still pending, since nothing waits on them any more
+                unfinished = [bracket for bracket in brackets if not bracket.done]
+                client.cancel(
+                    list(pending.futures)
+                    + [future for bracket in unfinished for future in bracket.evaluated]
+                )
+                pending.clear()
+                return results
+
+    return results
 
 
 def successive_halving(
-    n: int,
-    r: float,
+    client: dask.distributed.Client,
+    plan: BracketPlan,
+    configs: Sequence[Config],
+    run_then_return_val_loss: Callable[..., Any],
     eta: float,
-    get_hyperparameter_configuration: Callable[[int], Sequence[Config]],
-    run_then_return_val_loss: Callable[[Config, float], float],
+    incremental: bool = False,
+    asynchronous: bool = False,
 ) -> ConfigEvaluation:
     """Run a bracket of successive halving.
 
     Args:
-        n: The initial number of configurations to sample.
-        r: The minimum resource to allocate to each configuration.
-        eta: The culling factor.
-        get_hyperparameter_configuration: A function that takes a number n and returns
-            n randomly sampled hyperparameter configurations.
+        client: The Dask distributed client to run the evaluations on.
+        plan: The number of configurations and resources to use in each round.
+        configs: The `plan.n` hyperparameter configurations to start with. Duplicates
+            are only evaluated once, as long as they tokenize deterministically.
         run_then_return_val_loss: A function that takes a hyperparameter configuration
             and a resource allocation and returns the validation loss after training
-            using the amount of specified resources.
+            using the amount of specified resources. Results are memoized on
+            `(config, resources)`, which relies on configurations tokenizing
+            deterministically with `dask.base.tokenize`. Dask gives any other
+            configuration a random token, so duplicates of it are neither
+            deduplicated nor share their evaluations, and are simply trained again. If
+            it has a `run_batch` attribute, a function that takes a list of
+            configurations and a resource allocation and returns their losses, each
+            round of synchronous successive halving is evaluated with one call to it.
+            Such a call is memoized on the whole round rather than on each
+            `(config, resources)` pair, so a config already evaluated at the same
+            resources as part of a different round is evaluated again.
+        eta: The culling factor.
+        incremental: If `True`, `run_then_return_val_loss` instead takes a
+            configuration, the resources it has already been trained with, the total
+            resources to train it with, and the training state returned by its previous
+            call (`None` at the first rung), and returns a tuple `(loss, state)`. This
+            lets each rung resume training its survivors rather than starting over.
+        asynchronous: If `True`, promote configurations as soon as they rank in the top
+            1 / eta of their round so far (ASHA), rather than waiting for the slowest
+            evaluation of every round.
 
     Returns:
         A named tuple `(config, loss)` containing the configuration with the lowest loss.
 
     """
-    T = get_hyperparameter_configuration(n)
-    s = math.floor(math.log(n, eta))
-    for i in range(s + 1):
-        n_i = math.floor(n * (eta ** -i))
-        r_i = r * (eta ** i)
-
-        client = dask.distributed.get_client()
-
-        dask.distributed.secede()
-        futures = client.map(lambda t: run_then_return_val_loss(t, r_i), T)
-        L = client.gather(futures)
-        dask.distributed.rejoin()
-
-        T, losses = _top_k(T, L, max(1, math.floor(n_i / eta)))
-
-    return ConfigEvaluation(T[0], losses[0])
+    (result,) = _run_brackets(
+        client,
+        [plan],
+        [configs],
+        run_then_return_val_loss,
+        eta,
+        incremental,
+        asynchronous,
+    )
+    return result
 
 
 class Hyperband:
@@ -91,14 +634,23 @@ class Hyperband:
             n randomly sampled hyperparameter configurations.
         run_then_return_val_loss: A function that takes a hyperparameter configuration
             and a resource allocation and returns the validation loss after training
-            using the amount of specified resources.
+            using the amount of specified resources. See `successive_halving` for how
+            results are memoized, and for the optional `run_batch` attribute.
         R: The maximum resources allocated to any hyperparameter configuration. Must be
             greater than or equal to 1.0.
         eta: A factor controlling the poportion of hyperparameter configurations to cull
             in each iteration of SuccessiveHalving. The optimal value is e (2.718...),
             typical values are 3 or 4. Must be strictly positive.
         client: A Dask distributed client to execute the hyperparameter search on. If
-            `None`, runs the search locally.
+            `None`, runs the search on a local cluster shared by every such instance.
+        incremental: If `True`, survivors of each round of SuccessiveHalving resume
+            training from their previous state instead of starting over. See
+            `successive_halving` for the signature `run_then_return_val_loss` must then
+            have.
+        asynchronous: If `True`, run each bracket with asynchronous successive halving
+            (ASHA), which promotes a configuration as soon as it ranks in the top
+            1 / eta of its round so far instead of waiting for the round to finish.
+            This keeps workers busy when evaluation times vary.
 
     Raises:
         ValueError: if R is less than 1.0, or if eta is not strictly positive.
@@ -108,13 +660,17 @@ class Hyperband:
     def __init__(  # noqa: D107
         self,
         get_hyperparameter_configuration: Callable[[int], Sequence[Config]],
-        run_then_return_val_loss: Callable[[Config, float], float],
+        run_then_return_val_loss: Callable[..., Any],
         R: float,
         eta: float = 3.0,
         client: Optional[dask.distributed.Client] = None,
+        incremental: bool = False,
+        asynchronous: bool = False,
     ) -> None:
         self.get_hyperparameter_configuration = get_hyperparameter_configuration
         self.run_then_return_val_loss = run_then_return_val_loss
+        self.incremental = incremental
+        self.asynchronous = asynchronous
 
         if R < 1.0:
             raise ValueError("R is {0:.2f}, but it must be >= 1.0.".format(R))
@@ -124,38 +680,52 @@ class Hyperband:
             raise ValueError("eta is {0:.2f}, but it must be > 0.".format(eta))
         self.eta = eta
 
-        self.s_max = math.floor(math.log(self.R, self.eta))
+        # log(R) / log(eta) can land just below an exact integer, e.g. 4.999... for
+        # R = 243 and eta = 3, so check the floor against the powers of eta themselves
+        self.s_max = math.floor(math.log(self.R) / math.log(self.eta))
+        if self.eta ** (self.s_max + 1) <= self.R:
+            self.s_max += 1
         self.B = (self.s_max + 1) * self.R
+        self.schedule = _bracket_schedule(self.R, self.eta, self.s_max)
 
-        if client is None:
-            cluster = dask.distributed.LocalCluster(
-                processes=False, dashboard_address=None
-            )
-            self.client = dask.distributed.Client(cluster)
-        else:
-            self.client = client
+        # Starting a cluster takes seconds, so instances without a client of their own
+        # all share one local cluster rather than starting one each
+        self.client = _default_client() if client is None else client
 
-    def run(self) -> ConfigEvaluation:
+    def run(self, patience: Optional[int] = None) -> ConfigEvaluation:
         """Run Hyperband.
 
+        Args:
+            patience: If given, stop once this many brackets in a row, from the most
+                aggressive (s = s_max) down, have not improved on the best loss so far.
+                The brackets still running are cancelled. This mostly skips the last
+                brackets, which spend the most resources on each configuration. Must be
+                at least 1; pass `None` to run every bracket.
+
         Returns:
             A named tuple `(config, loss)` containing the best hyperparameter config and
             its associated loss.
 
+        Raises:
+            ValueError: if patience is given and is less than 1.
+
         """
-        futures = []
-        for s in range(self.s_max, -1, -1):
-            n = math.ceil((self.B * (self.eta ** s)) / (self.R * (s + 1)))
-            r = self.R * (self.eta ** -s)
-
-            futures.append(
-                self.client.submit(
-                    successive_halving,
-                    n,
-                    r,
-                    self.eta,
-                    self.get_hyperparameter_configuration,
-                    self.run_then_return_val_loss,
-                )
+        if patience is not None and patience < 1:
+            raise ValueError(
+                "patience is {0}, but it must be >= 1 or None.".format(patience)
             )
-        return min(self.client.gather(futures), key=lambda x: x.loss)
+
+        samples = [
+            self.get_hyperparameter_configuration(plan.n) for plan in self.schedule
+        ]
+        results = _run_brackets(
+            self.client,
+            self.schedule,
+            samples,
+            self.run_then_return_val_loss,
+            self.eta,
+            self.incremental,
+            self.asynchronous,
+            patience,
+        )
+        return min(results, key=lambda x: x.loss)
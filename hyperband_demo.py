@@ -9,10 +9,11 @@ yaml.warnings({"YAMLLoadWarning": False})
 import argparse  # noqa: E402
 import random  # noqa: E402
 import typing  # noqa: E402
-from typing import Iterable  # noqa: E402
+from typing import Iterable, Sequence  # noqa: E402
 
 import dask.distributed  # noqa: E402
 import dask_jobqueue  # noqa: E402
+import numpy as np  # noqa: E402
 
 import hyperband  # noqa: E402
 
@@ -42,6 +43,16 @@ def run_then_return_val_loss(config: Config, resources: float) -> float:
     return loss
 
 
+def run_batch(configs: Sequence[Config], resources: float) -> np.ndarray:
+    """Sample the noisy quadratic for every config in one vectorized draw."""
+    rhos = np.fromiter((config.rho for config in configs), dtype=float)
+    return np.random.normal(rhos ** 2, 40.0 / resources)
+
+
+# Let Hyperband evaluate whole rounds with a single call
+run_then_return_val_loss.run_batch = run_batch  # type: ignore
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run a hyperparameter search.")
     parser.add_argument(
@@ -54,6 +65,16 @@ if __name__ == "__main__":
             + "network as the worker nodes."
         ),
     )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help=(
+            "directory in which to cache evaluations on disk, so that restarted"
+            + " searches reuse them. On a SLURM cluster, put it on a filesystem shared"
+            + " by all the nodes, such as $SCRATCH. Requires joblib."
+        ),
+    )
     args = parser.parse_args()
 
     if args.use_slurm:
@@ -65,23 +86,43 @@ if __name__ == "__main__":
             queue="all",
             local_directory="/tmp/",
             interfacestr="em2",
+            # Each worker process runs one evaluation at a time, so stop NumPy's BLAS
+            # from starting a thread per core in every process and oversubscribing
+            job_script_prologue=[
+                "export OMP_NUM_THREADS=1",
+                "export MKL_NUM_THREADS=1",
+                "export OPENBLAS_NUM_THREADS=1",
+            ],
         )
         cluster.scale(16)  # Ask the cluster for 16 worker processes, wait until arrival
 
         # Print a link to the HTTP diagnostics server
         print("Dashboard link: {0}".format(cluster.dashboard_link))
     else:
-        cluster = dask.distributed.LocalCluster(processes=False, dashboard_address=None)
+        # Run one evaluation at a time, so the BLAS threads of a NumPy loss have the
+        # cores to themselves instead of oversubscribing them
+        cluster = dask.distributed.LocalCluster(
+            processes=False, n_workers=1, threads_per_worker=1, dashboard_address=None
+        )
     client = dask.distributed.Client(cluster)
 
+    run = run_then_return_val_loss
+    if args.cache_dir is not None:
+        import joblib  # Only needed when caching, so import it here
+
+        # The cache stores one loss per (config, resources) pair on disk, so evaluations
+        # go through it one at a time rather than through the run_batch hook
+        run = joblib.Memory(args.cache_dir, verbose=0).cache(run_then_return_val_loss)
+
     tuner = hyperband.Hyperband(
         get_hyperparameter_configuration,
-        run_then_return_val_loss,
+        run,
         R=81.0,
         eta=3.0,
         client=client,
     )
     best_config = tuner.run()
+    client.close()
     cluster.close()
 
     print("Best config: {0}".format(best_config))
@@ -0,0 +1,156 @@
+"""Tests for the hyperband module."""
+import collections
+import itertools
+import random
+import threading
+import time
+import typing
+from typing import Any, Iterator, Tuple
+
+import dask.distributed
+import pytest
+
+import hyperband
+
+# The resources of every evaluation run so far. The test cluster runs its workers as
+# threads of this process, so they can all record here.
+_evaluations: typing.Counter[float] = collections.Counter()
+_lock = threading.Lock()
+
+
+def _run_then_return_val_loss(config: int, resources: float) -> float:
+    """Record the evaluation, and return a noisy loss after a random delay."""
+    with _lock:
+        _evaluations[resources] += 1
+    time.sleep(random.uniform(0.0, 0.01))
+    return config + random.gauss(0.0, 20.0 / resources)
+
+
+def _train_incrementally(
+    config: int, r_prev: float, resources: float, state: Any
+) -> Tuple[float, Tuple[int, float]]:
+    """Check the state handed over from the previous round, and return a new one."""
+    assert (state is None) == (r_prev == 0.0)
+    assert state is None or state == (config, r_prev)
+    return _run_then_return_val_loss(config, resources), (config, resources)
+
+
+def _config_as_loss(config: int, resources: float) -> float:
+    """Record the evaluation, and return the config itself as its loss.
+
+    Evaluations take longer the more resources they are given, as training does.
+
+    """
+    with _lock:
+        _evaluations[resources] += 1
+    time.sleep(0.001 * resources)
+    return float(config)
+
+
+@pytest.fixture(scope="module")
+def client() -> Iterator[dask.distributed.Client]:
+    """Yield a client of a local cluster running in this process."""
+    cluster = dask.distributed.LocalCluster(processes=False, dashboard_address=None)
+    client = dask.distributed.Client(cluster)
+    yield client
+    client.close()
+    cluster.close()
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_bracket_promotes_as_many_configs_as_synchronous(
+    client: dask.distributed.Client, asynchronous: bool
+) -> None:
+    """Both kinds of bracket should send each round exactly plan.n_is configs."""
+    plan = hyperband._bracket_schedule(81.0, 3.0, 4)[0]
+    _evaluations.clear()
+    hyperband.successive_halving(
+        client,
+        plan,
+        list(range(plan.n)),
+        _run_then_return_val_loss,
+        3.0,
+        asynchronous=asynchronous,
+    )
+    assert [_evaluations[r_i] for r_i in plan.r_is] == list(plan.n_is)
+
+
+@pytest.mark.parametrize("asynchronous", [False, True])
+def test_incremental_bracket_resumes_from_previous_state(
+    client: dask.distributed.Client, asynchronous: bool
+) -> None:
+    """Each round should resume from the state its config reached the round before."""
+    plan = hyperband._bracket_schedule(81.0, 3.0, 4)[0]
+    _evaluations.clear()
+    hyperband.successive_halving(
+        client,
+        plan,
+        list(range(plan.n)),
+        _train_incrementally,
+        3.0,
+        incremental=True,
+        asynchronous=asynchronous,
+    )
+    assert [_evaluations[r_i] for r_i in plan.r_is] == list(plan.n_is)
+
+
+def test_run_rejects_patience_below_one() -> None:
+    """A patience below 1 should raise rather than stop after the first bracket."""
+    # The check comes before any work is submitted, so no client is needed
+    client: typing.Any = object()
+    tuner = hyperband.Hyperband(
+        lambda n: list(range(n)), _run_then_return_val_loss, R=9.0, client=client
+    )
+    for patience in (0, -1):
+        with pytest.raises(ValueError):
+            tuner.run(patience=patience)
+
+
+@pytest.mark.parametrize("R, eta, s_max", [(243.0, 3.0, 5), (1000.0, 10.0, 3)])
+def test_s_max_counts_exact_powers_of_eta(R: float, eta: float, s_max: int) -> None:
+    """log(R) / log(eta) lands just below these integers, which must not floor down."""
+    client: typing.Any = object()
+    tuner = hyperband.Hyperband(
+        lambda n: list(range(n)), _run_then_return_val_loss, R=R, eta=eta, client=client
+    )
+    assert tuner.s_max == s_max
+
+
+def test_bracket_schedule_rounds_and_sizes() -> None:
+    """Bracket s should run s + 1 rounds within R, without flooring exact quotients."""
+    schedule = hyperband._bracket_schedule(81.0, 3.0, 4)
+    for s, plan in zip(range(4, -1, -1), schedule):
+        assert len(plan.r_is) == s + 1
+        assert max(plan.r_is) <= 81.0
+    assert schedule[0].n_is == (81, 27, 9, 3, 1)
+
+
+def test_run_stops_after_patience_brackets_without_improvement() -> None:
+    """Patience should skip brackets that cannot improve, and find the same best."""
+    # With a single thread, the later brackets only run while the earlier ones wait
+    # on the client, so most of their work is still queued when the search stops. The
+    # module's cluster already holds the default dashboard port.
+    cluster = dask.distributed.LocalCluster(
+        processes=False, n_workers=1, threads_per_worker=1, dashboard_address=":0"
+    )
+    client = dask.distributed.Client(cluster)
+    results = []
+    evaluations = []
+    for patience in (None, 1):
+        # Every bracket samples larger configs than the last, so only the first
+        # bracket, s = s_max, can improve on the best loss
+        counter = itertools.count()
+        tuner = hyperband.Hyperband(
+            lambda n: [next(counter) for _ in range(n)],
+            _config_as_loss,
+            R=81.0,
+            client=client,
+        )
+        _evaluations.clear()
+        results.append(tuner.run(patience=patience))
+        evaluations.append(sum(_evaluations.values()))
+    client.close()
+    cluster.close()
+
+    assert results[0] == results[1] == hyperband.ConfigEvaluation(0, 0.0)
+    assert evaluations[1] < evaluations[0]